@@ -9,5 +9,5 @@ setup(name='simtree',
       license='GPL',
       packages=['simtree'],
       install_requires=[
-          'matplotlib', 'numpy', 'sklearn'],
+          'matplotlib', 'numpy', 'sklearn', 'scipy', 'numba'],
       zip_safe=False)
@@ -1,10 +1,10 @@
 import numpy as np
-from copy import deepcopy
+from numba import njit
+from scipy.special import expit
 from matplotlib import gridspec
 import matplotlib.pyplot as plt
 
 from sklearn.linear_model import Lasso
-from sklearn.utils.extmath import softmax
 from sklearn.preprocessing import LabelBinarizer
 from sklearn.utils import check_X_y, column_or_1d
 from sklearn.model_selection import train_test_split
@@ -18,15 +18,43 @@ from .smspline import SMSplineRegressor, SMSplineClassifier
 __all__ = ["SimRegressor", "SimClassifier"]
 
 
+def _support_dot(x, beta):
+
+    """calculate x @ beta using only the columns in the support of beta when at most a quarter of beta is nonzero,
+    otherwise gathering the columns costs more than the plain product
+    """
+
+    nz = np.flatnonzero(beta)
+    if len(nz) <= beta.shape[0] // 4:
+        return np.dot(x[:, nz], beta[nz])
+    return np.dot(x, beta)
+
+
+@njit(fastmath=True, cache=True)
+def _adam_step(theta, m_t, v_t, g_t, beta_1, beta_2, learning_rate, b1_t, b2_t, eps):
+
+    """update theta, m_t and v_t in place with one adam step, b1_t and b2_t being beta_1 ** t and beta_2 ** t
+    """
+
+    m_corr = 1 - b1_t
+    v_corr = 1 - b2_t
+    for i in range(theta.shape[0]):
+        g = g_t[i]
+        m_t[i, 0] = beta_1 * m_t[i, 0] + (1 - beta_1) * g
+        v_t[i, 0] = beta_2 * v_t[i, 0] + (1 - beta_2) * g * g
+        theta[i, 0] -= learning_rate * (m_t[i, 0] / m_corr) / (np.sqrt(v_t[i, 0] / v_corr) + eps)
+
+
 class BaseSim(BaseEstimator, metaclass=ABCMeta):
 
     @abstractmethod
-    def __init__(self, reg_lambda=0, reg_gamma=1e-5, knot_num=5, degree=3, random_state=0):
+    def __init__(self, reg_lambda=0, reg_gamma=1e-5, knot_num=5, degree=3, dtype=np.float64, random_state=0):
 
         self.reg_lambda = reg_lambda
         self.reg_gamma = reg_gamma
         self.knot_num = knot_num
         self.degree = degree
+        self.dtype = dtype
         self.random_state = random_state
 
     def _first_order_thres(self, x, y):
@@ -46,11 +74,10 @@ class BaseSim(BaseEstimator, metaclass=ABCMeta):
         """
 
         if self.reg_lambda == 0:
-            mu = np.average(x, axis=0)
-            cov = np.cov(x.T)
-            inv_cov = np.linalg.pinv(cov, 1e-7)
-            s1 = np.dot(inv_cov, (x - mu).T).T
-            zbar = np.average(y.reshape(-1, 1) * s1, axis=0)
+            mu = x.mean(0)
+            xc = x - mu
+            cov = np.dot(xc.T, xc) / (xc.shape[0] - 1)
+            zbar = np.linalg.lstsq(cov, np.dot(xc.T, y) / xc.shape[0], rcond=1e-7)[0]
         else:
             mx = x.mean(0)
             sx = x.std(0) + 1e-7
@@ -58,11 +85,12 @@ class BaseSim(BaseEstimator, metaclass=ABCMeta):
             lr = Lasso(alpha=self.reg_lambda)
             lr.fit(nx, y)
             zbar = lr.coef_ / sx
-        if np.linalg.norm(zbar) > 0:
-            beta = zbar / np.linalg.norm(zbar)
+        zbar_norm = np.sqrt(np.dot(zbar, zbar))
+        if zbar_norm > 0:
+            beta = zbar / zbar_norm
         else:
             beta = zbar
-        return beta.reshape([-1, 1])
+        return beta.reshape([-1, 1]).astype(self.dtype)
 
     def fit(self, x, y):
 
@@ -80,16 +108,14 @@ class BaseSim(BaseEstimator, metaclass=ABCMeta):
             self : Estimator instance.
         """
 
-        np.random.seed(self.random_state)
         x, y = self._validate_input(x, y)
         n_samples, n_features = x.shape
         self.beta_ = self._first_order_thres(x, y)
 
-        if len(self.beta_[np.abs(self.beta_) > 0]) > 0:
-            if (self.beta_[np.argmax(np.abs(self.beta_))] < 0):
-                self.beta_ = - self.beta_
-        xb = np.dot(x, self.beta_)
-        self._estimate_shape(xb, y, np.min(xb), np.max(xb))
+        if self.beta_.flat[np.abs(self.beta_).argmax()] < 0:
+            self.beta_ = - self.beta_
+        xb = _support_dot(x, self.beta_)
+        self.shape_fit_ = self._estimate_shape(xb, y, np.min(xb), np.max(xb))
         return self
 
     def decision_function(self, x):
@@ -114,7 +140,8 @@ class BaseSim(BaseEstimator, metaclass=ABCMeta):
 
     def fit_middle_update_adam(self, x, y, val_ratio=0.2, tol=0.0001,
                   max_middle_iter=100, n_middle_iter_no_change=5, max_inner_iter=100, n_inner_iter_no_change=5,
-                  batch_size=100, learning_rate=1e-3, beta_1=0.9, beta_2=0.999, stratify=True, verbose=False):
+                  batch_size=100, learning_rate=1e-3, beta_1=0.9, beta_2=0.999, stratify=True, verbose=False,
+                  val_eval_stride=1):
 
         """fine tune the fitted Sim model using middle update method (adam)
 
@@ -124,8 +151,8 @@ class BaseSim(BaseEstimator, metaclass=ABCMeta):
             containing the input dataset
         y : array-like of shape (n_samples,)
             containing target values
-        val_ratio : float, optional, default=0.2
-            the split ratio for validation set
+        val_ratio : float or int, optional, default=0.2
+            the split ratio for validation set, or the number of validation samples if int
         tol : float, optional, default=0.0001
             the tolerance for early stopping
         max_middle_iter : int, optional, default=3
@@ -148,13 +175,26 @@ class BaseSim(BaseEstimator, metaclass=ABCMeta):
             whether to stratify the target variable when splitting the validation set
         verbose : bool, optional, default=False
             whether to show the training history
+        val_eval_stride : int, optional, default=1
+            the validation loss of the inner iterations is evaluated every val_eval_stride epochs (and at the last epoch),
+            n_inner_iter_no_change then counts the evaluated epochs only
         """
-            
+
+        if not isinstance(val_eval_stride, (int, np.integer)) or val_eval_stride < 1:
+            raise ValueError("val_eval_stride must be an integer >= 1, got %s." % val_eval_stride)
+
         x, y = self._validate_input(x, y)
         n_samples = x.shape[0]
+        rng = np.random.default_rng(self.random_state)
         if is_regressor(self):
-            idx1, idx2 = train_test_split(np.arange(n_samples), test_size=val_ratio,
-                                          random_state=self.random_state)
+            permutation = rng.permutation(n_samples)
+            if isinstance(val_ratio, (int, np.integer)):
+                val_size = int(val_ratio)
+            else:
+                val_size = int(np.ceil(val_ratio * n_samples))
+            if not 0 < val_size < n_samples:
+                raise ValueError("val_ratio must leave both the training and validation sets non-empty, got %s." % val_ratio)
+            idx1, idx2 = permutation[val_size:], permutation[:val_size]
             tr_x, tr_y, val_x, val_y = x[idx1], y[idx1], x[idx2], y[idx2]
         elif is_classifier(self):
             if stratify:
@@ -163,8 +203,11 @@ class BaseSim(BaseEstimator, metaclass=ABCMeta):
                 idx1, idx2 = train_test_split(np.arange(n_samples),test_size=val_ratio, random_state=self.random_state)
             tr_x, tr_y, val_x, val_y = x[idx1], y[idx1], x[idx2], y[idx2]
         
-        batch_size = min(batch_size, tr_x.shape[0])
-        val_xb = np.dot(val_x, self.beta_)
+        train_size = tr_x.shape[0]
+        batch_size = min(batch_size, train_size)
+        # the split already returns the training samples in random order, so the first epoch needs no reshuffle
+        shuffle_index = np.arange(train_size)
+        val_xb = _support_dot(val_x, self.beta_)
         if is_regressor(self):
             val_pred = self.shape_fit_.predict(val_xb)
             val_loss = self.shape_fit_.get_loss(val_y, val_pred)
@@ -172,59 +215,60 @@ class BaseSim(BaseEstimator, metaclass=ABCMeta):
             val_pred = self.shape_fit_.predict_proba(val_xb)[:, 1]
             val_loss = self.shape_fit_.get_loss(val_y, val_pred)
 
-        self_copy = deepcopy(self)
+        beta, shape_fit = self.beta_, self.shape_fit_
+        best_beta, best_shape_fit = beta, shape_fit
         no_middle_iter_change = 0
         val_loss_middle_iter_best = val_loss
         for middle_iter in range(max_middle_iter):
 
-            m_t = 0 # moving average of the gradient
-            v_t = 0 # moving average of the gradient square
-            num_updates = 0
+            theta_0 = beta.copy()
+            m_t = np.zeros_like(theta_0) # moving average of the gradient
+            v_t = np.zeros_like(theta_0) # moving average of the gradient square
+            g_t = np.empty(theta_0.shape[0]) # gradient buffer
+            b1_t = 1.0 # beta_1 to the power of the number of updates
+            b2_t = 1.0 # beta_2 to the power of the number of updates
             no_inner_iter_change = 0
-            theta_0 = self_copy.beta_ 
-            train_size = tr_x.shape[0]
             val_loss_inner_iter_best = np.inf
             for inner_iter in range(max_inner_iter):
 
-                shuffle_index = np.arange(tr_x.shape[0])
-                np.random.shuffle(shuffle_index)
-                tr_x = tr_x[shuffle_index]
-                tr_y = tr_y[shuffle_index]
-
                 for iterations in range(train_size // batch_size):
 
-                    num_updates += 1
+                    b1_t *= beta_1
+                    b2_t *= beta_2
                     offset = (iterations * batch_size) % train_size
-                    batch_xx = tr_x[offset:(offset + batch_size), :]
-                    batch_yy = tr_y[offset:(offset + batch_size)]
+                    batch_idx = shuffle_index[offset:(offset + batch_size)]
+                    batch_xx = np.take(tr_x, batch_idx, axis=0)
+                    batch_yy = np.take(tr_y, batch_idx)
 
                     xb = np.dot(batch_xx, theta_0)
-                    if is_regressor(self_copy):
-                        r = batch_yy - self_copy.shape_fit_.predict(xb).ravel()
-                    elif is_classifier(self_copy):
-                        r = batch_yy - self_copy.shape_fit_.predict_proba(xb)[:, 1]
-                    
-                    # gradient
-                    dfxb = self_copy.shape_fit_.diff(xb, order=1).ravel()
-                    g_t = np.average((- dfxb * r).reshape(-1, 1) * batch_xx, axis=0).reshape(-1, 1)
-
-                    # update the moving average 
-                    m_t = beta_1 * m_t + (1 - beta_1) * g_t
-                    v_t = beta_2 * v_t + (1 - beta_2) * (g_t * g_t)
-                    # calculates the bias-corrected estimates
-                    m_cap = m_t / (1 - (beta_1 ** (num_updates)))  
-                    v_cap = v_t / (1 - (beta_2 ** (num_updates)))
-                    # updates the parameters
-                    theta_0 = theta_0 - (learning_rate * m_cap) / (np.sqrt(v_cap) + 1e-8)
+                    pred = shape_fit.decision_function(xb)
+                    dfxb = shape_fit.diff(xb, order=1)
+                    if is_regressor(self):
+                        r = batch_yy - pred.ravel()
+                    elif is_classifier(self):
+                        r = batch_yy - expit(pred.ravel())
+
+                    # gradient, the residual array is reused as the sample weights
+                    r *= dfxb.ravel()
+                    r *= - 1.0 / batch_size
+                    np.dot(batch_xx.T, r, out=g_t)
+
+                    # update the moving averages and the parameters
+                    _adam_step(theta_0, m_t, v_t, g_t, beta_1, beta_2, learning_rate, b1_t, b2_t, 1e-8)
+
+                # reshuffle the training samples for the next epoch
+                shuffle_index = rng.permutation(train_size)
 
                 # validation loss
+                if ((inner_iter + 1) % val_eval_stride != 0) and (inner_iter < max_inner_iter - 1):
+                    continue
                 val_xb = np.dot(val_x, theta_0)
-                if is_regressor(self_copy):
-                    val_pred = self_copy.shape_fit_.predict(val_xb)
-                    val_loss = self_copy.shape_fit_.get_loss(val_y, val_pred)
-                elif is_classifier(self_copy):
-                    val_pred = self_copy.shape_fit_.predict_proba(val_xb)[:, 1]
-                    val_loss = self_copy.shape_fit_.get_loss(val_y, val_pred)
+                if is_regressor(self):
+                    val_pred = shape_fit.predict(val_xb)
+                    val_loss = shape_fit.get_loss(val_y, val_pred)
+                elif is_classifier(self):
+                    val_pred = shape_fit.predict_proba(val_xb)[:, 1]
+                    val_loss = shape_fit.get_loss(val_y, val_pred)
                 if verbose:
                     print("Middle iter:", middle_iter + 1, "Inner iter:", inner_iter + 1, "with validation loss:", np.round(val_loss, 5))
                 # stop criterion
@@ -238,37 +282,39 @@ class BaseSim(BaseEstimator, metaclass=ABCMeta):
                 if no_inner_iter_change >= n_inner_iter_no_change:
                     break
   
-            ## normalization
-            if np.linalg.norm(theta_0) > 0:
-                theta_0 = theta_0 / np.linalg.norm(theta_0)
-                if (theta_0[np.argmax(np.abs(theta_0))] < 0):
+            ## normalization, val_xb always holds val_x @ theta_0 here and is rescaled accordingly
+            theta_norm = np.linalg.norm(theta_0)
+            if theta_norm > 0:
+                theta_0 = theta_0 / theta_norm
+                val_xb = val_xb / theta_norm
+                if theta_0.flat[np.abs(theta_0).argmax()] < 0:
                     theta_0 = - theta_0
+                    val_xb = - val_xb
+
+            # ridge update, the new spline is kept local until the end so self stays consistent on failure
+            beta = theta_0
+            tr_xb = np.dot(tr_x, beta)
+            shape_fit = self._estimate_shape(tr_xb, tr_y, np.min(tr_xb), np.max(tr_xb))
 
-            # ridge update
-            self_copy.beta_ = theta_0
-            tr_xb = np.dot(tr_x, self_copy.beta_)
-            self_copy._estimate_shape(tr_xb, tr_y, np.min(tr_xb), np.max(tr_xb))
-            
-            val_xb = np.dot(val_x, self_copy.beta_)
-            if is_regressor(self_copy):
-                val_pred = self_copy.shape_fit_.predict(val_xb)
-                val_loss = self_copy.shape_fit_.get_loss(val_y, val_pred)
-            elif is_classifier(self_copy):
-                val_pred = self_copy.shape_fit_.predict_proba(val_xb)[:, 1]
-                val_loss = self_copy.shape_fit_.get_loss(val_y, val_pred)
+            if is_regressor(self):
+                val_pred = shape_fit.predict(val_xb)
+                val_loss = shape_fit.get_loss(val_y, val_pred)
+            elif is_classifier(self):
+                val_pred = shape_fit.predict_proba(val_xb)[:, 1]
+                val_loss = shape_fit.get_loss(val_y, val_pred)
 
             if val_loss > val_loss_middle_iter_best - tol:
                 no_middle_iter_change += 1
             else:
                 no_middle_iter_change = 0
             if val_loss < val_loss_middle_iter_best:
-                self.beta_ = self_copy.beta_
-                self.shape_fit_ = self_copy.shape_fit_
+                best_beta, best_shape_fit = beta, shape_fit
                 val_loss_middle_iter_best = val_loss
             if no_middle_iter_change >= n_middle_iter_no_change:
                 break
-                
-        self = deepcopy(self_copy)
+
+        self.beta_ = best_beta
+        self.shape_fit_ = best_shape_fit
 
     def visualize(self):
 
@@ -302,9 +348,9 @@ class BaseSim(BaseEstimator, metaclass=ABCMeta):
 
         ax2 = plt.Subplot(fig, outer[1])
         if len(self.beta_) <= 50:
-            ax2.barh(np.arange(len(self.beta_)), [beta for beta in self.beta_.ravel()][::-1])
+            ax2.barh(np.arange(len(self.beta_)), self.beta_.ravel()[::-1])
             ax2.set_yticks(np.arange(len(self.beta_)))
-            ax2.set_yticklabels(["X" + str(idx + 1) for idx in range(len(self.beta_.ravel()))][::-1])
+            ax2.set_yticklabels(["X" + str(idx) for idx in range(len(self.beta_), 0, -1)])
             ax2.set_xlim(xlim_min, xlim_max)
             ax2.set_ylim(-1, len(self.beta_))
             ax2.axvline(0, linestyle="dotted", color="black")
@@ -313,9 +359,9 @@ class BaseSim(BaseEstimator, metaclass=ABCMeta):
             left = len(self.beta_) - 1 - right
             input_ticks = np.unique(np.hstack([left, right])).astype(int)
 
-            ax2.barh(np.arange(len(self.beta_)), [beta for beta in self.beta_.ravel()][::-1])
+            ax2.barh(np.arange(len(self.beta_)), self.beta_.ravel()[::-1])
             ax2.set_yticks(input_ticks)
-            ax2.set_yticklabels(["X" + str(idx + 1) for idx in input_ticks][::-1])
+            ax2.set_yticklabels(["X" + str(idx + 1) for idx in input_ticks[::-1]])
             ax2.set_xlim(xlim_min, xlim_max)
             ax2.set_ylim(-1, len(self.beta_))
             ax2.axvline(0, linestyle="dotted", color="black")
@@ -343,16 +389,20 @@ class SimRegressor(BaseSim, RegressorMixin):
     knot_num : int, optional. default=5
         Number of knots
 
+    dtype : numpy floating type, optional. default=np.float64
+        Precision of the fitting data, np.float32 is faster but may lose precision
+
     random_state : int, optional. default=0
         Random seed
     """
 
-    def __init__(self, reg_lambda=0, reg_gamma=1e-5, knot_num=5, degree=3, random_state=0):
+    def __init__(self, reg_lambda=0, reg_gamma=1e-5, knot_num=5, degree=3, dtype=np.float64, random_state=0):
 
         super(SimRegressor, self).__init__(reg_lambda=reg_lambda,
                                 reg_gamma=reg_gamma,
                                 knot_num=knot_num,
                                 degree=degree,
+                                dtype=dtype,
                                 random_state=random_state)
 
     def _validate_input(self, x, y):
@@ -368,8 +418,8 @@ class SimRegressor(BaseSim, RegressorMixin):
         """
 
         x, y = check_X_y(x, y, accept_sparse=["csr", "csc", "coo"],
-                         multi_output=True, y_numeric=True)
-        return x, y.ravel()
+                         multi_output=True, y_numeric=True, dtype=self.dtype, order="C")
+        return x, y.ravel().astype(self.dtype, copy=False)
 
     def _estimate_shape(self, x, y, xmin, xmax):
 
@@ -385,11 +435,16 @@ class SimRegressor(BaseSim, RegressorMixin):
             the minimum value of beta ^ x
         xmax : float
             the maximum value of beta ^ x
+        Returns
+        -------
+        object
+            the fitted SMSplineRegressor instance
         """
 
-        self.shape_fit_ = SMSplineRegressor(knot_num=self.knot_num, reg_gamma=self.reg_gamma,
-                                xmin=xmin, xmax=xmax, degree=self.degree)
-        self.shape_fit_.fit(x, y)
+        shape_fit = SMSplineRegressor(knot_num=self.knot_num, reg_gamma=self.reg_gamma,
+                                xmin=float(xmin), xmax=float(xmax), degree=self.degree)
+        shape_fit.fit(np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64))
+        return shape_fit
 
     def predict(self, x):
 
@@ -427,16 +482,20 @@ class SimClassifier(BaseSim, ClassifierMixin):
     knot_num : int, optional. default=5
         Number of knots
 
+    dtype : numpy floating type, optional. default=np.float64
+        Precision of the fitting data, np.float32 is faster but may lose precision
+
     random_state : int, optional. default=0
         Random seed
     """
 
-    def __init__(self, reg_lambda=0, reg_gamma=1e-5, knot_num=5, degree=3, random_state=0):
+    def __init__(self, reg_lambda=0, reg_gamma=1e-5, knot_num=5, degree=3, dtype=np.float64, random_state=0):
 
         super(SimClassifier, self).__init__(reg_lambda=reg_lambda,
                                 reg_gamma=reg_gamma,
                                 knot_num=knot_num,
                                 degree=degree,
+                                dtype=dtype,
                                 random_state=random_state)
 
     def _validate_input(self, x, y):
@@ -452,7 +511,7 @@ class SimClassifier(BaseSim, ClassifierMixin):
         """
 
         x, y = check_X_y(x, y, accept_sparse=["csr", "csc", "coo"],
-                         multi_output=True)
+                         multi_output=True, dtype=self.dtype, order="C")
         if y.ndim == 2 and y.shape[1] == 1:
             y = column_or_1d(y, warn=False)
 
@@ -460,7 +519,7 @@ class SimClassifier(BaseSim, ClassifierMixin):
         self._label_binarizer.fit(y)
         self.classes_ = self._label_binarizer.classes_
 
-        y = self._label_binarizer.transform(y) * 1.0
+        y = self._label_binarizer.transform(y).astype(self.dtype)
         return x, y.ravel()
 
     def _estimate_shape(self, x, y, xmin, xmax):
@@ -477,11 +536,16 @@ class SimClassifier(BaseSim, ClassifierMixin):
             the minimum value of beta ^ x
         xmax : float
             the maximum value of beta ^ x
+        Returns
+        -------
+        object
+            the fitted SMSplineClassifier instance
         """
 
-        self.shape_fit_ = SMSplineClassifier(knot_num=self.knot_num, reg_gamma=self.reg_gamma,
-                                xmin=xmin, xmax=xmax, degree=self.degree)
-        self.shape_fit_.fit(x, y)
+        shape_fit = SMSplineClassifier(knot_num=self.knot_num, reg_gamma=self.reg_gamma,
+                                xmin=float(xmin), xmax=float(xmax), degree=self.degree)
+        shape_fit.fit(np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64))
+        return shape_fit
 
     def predict_proba(self, x):
 
@@ -498,7 +562,9 @@ class SimClassifier(BaseSim, ClassifierMixin):
         """
 
         pred = self.decision_function(x)
-        pred_proba = softmax(np.vstack([-pred, pred]).T / 2, copy=False)
+        pred_proba = np.empty((pred.shape[0], 2))
+        expit(pred, out=pred_proba[:, 1])
+        expit(- pred, out=pred_proba[:, 0])
         return pred_proba
 
     def predict(self, x):
@@ -28,7 +28,7 @@ class SIMTree(metaclass=ABCMeta):
 
     def __init__(self, max_depth=2, min_samples_leaf=50, min_impurity_decrease=0, feature_names=None,
                  split_features=None, n_screen_grid=5, n_feature_search=10, n_split_grid=20,
-                 degree=3, knot_num=30, reg_lambda=0, reg_gamma=1e-5, leaf_update=False, random_state=0):
+                 degree=3, knot_num=30, reg_lambda=0, reg_gamma=1e-5, leaf_update=False, dtype=np.float64, random_state=0):
 
         super(SIMTree, self).__init__(max_depth=max_depth,
                                  min_samples_leaf=min_samples_leaf,
@@ -44,6 +44,7 @@ class SIMTree(metaclass=ABCMeta):
         self.reg_gamma = reg_gamma
         self.reg_lambda = reg_lambda
         self.leaf_update = leaf_update
+        self.dtype = dtype
 
     def _validate_hyperparameters(self):
 
@@ -286,7 +287,7 @@ class SIMTreeRegressor(SIMTree, MoBTreeRegressor, RegressorMixin):
 
     def __init__(self, max_depth=2, min_samples_leaf=50, min_impurity_decrease=0, feature_names=None,
                  split_features=None, n_screen_grid=5, n_feature_search=10, n_split_grid=20,
-                 degree=3, knot_num=30, reg_lambda=0, reg_gamma=1e-5, leaf_update=False, random_state=0):
+                 degree=3, knot_num=30, reg_lambda=0, reg_gamma=1e-5, leaf_update=False, dtype=np.float64, random_state=0):
 
         super(SIMTreeRegressor, self).__init__(max_depth=max_depth,
                                  min_samples_leaf=min_samples_leaf,
@@ -301,10 +302,11 @@ class SIMTreeRegressor(SIMTree, MoBTreeRegressor, RegressorMixin):
                                  reg_lambda=reg_lambda,
                                  reg_gamma=reg_gamma,
                                  leaf_update=leaf_update,
+                                 dtype=dtype,
                                  random_state=random_state)
 
         self.base_estimator = SimRegressor(reg_lambda=0, reg_gamma=1e-5, degree=self.degree,
-                                 knot_num=self.knot_num, random_state=self.random_state)
+                                 knot_num=self.knot_num, dtype=self.dtype, random_state=self.random_state)
 
     def build_root(self):
 
@@ -315,7 +317,7 @@ class SIMTreeRegressor(SIMTree, MoBTreeRegressor, RegressorMixin):
     def build_leaf(self, sample_indice):
 
         base = SimRegressor(reg_gamma=self.reg_gamma, degree=self.degree,
-                      knot_num=self.knot_num, random_state=self.random_state)
+                      knot_num=self.knot_num, dtype=self.dtype, random_state=self.random_state)
         grid = GridSearchCV(base, param_grid={"reg_lambda": self.reg_lambda},
                       scoring={"mse": make_scorer(mean_squared_error, greater_is_better=False)},
                       cv=5, refit="mse", n_jobs=1, error_score=np.nan)
@@ -335,7 +337,7 @@ class SIMTreeClassifier(SIMTree, MoBTreeClassifier, ClassifierMixin):
 
     def __init__(self, max_depth=2, min_samples_leaf=50, min_impurity_decrease=0, feature_names=None,
                  split_features=None, n_screen_grid=5, n_feature_search=10, n_split_grid=20,
-                 degree=3, knot_num=30, reg_lambda=0, reg_gamma=1e-5, leaf_update=False, random_state=0):
+                 degree=3, knot_num=30, reg_lambda=0, reg_gamma=1e-5, leaf_update=False, dtype=np.float64, random_state=0):
 
         super(SIMTreeClassifier, self).__init__(max_depth=max_depth,
                                  min_samples_leaf=min_samples_leaf,
@@ -350,10 +352,11 @@ class SIMTreeClassifier(SIMTree, MoBTreeClassifier, ClassifierMixin):
                                  reg_lambda=reg_lambda,
                                  reg_gamma=reg_gamma,
                                  leaf_update=leaf_update,
+                                 dtype=dtype,
                                  random_state=random_state)
 
         self.base_estimator = SimClassifier(reg_lambda=0, reg_gamma=1e-5, degree=self.degree,
-                                 knot_num=self.knot_num, random_state=self.random_state)
+                                 knot_num=self.knot_num, dtype=self.dtype, random_state=self.random_state)
 
     def build_root(self):
 
@@ -369,7 +372,7 @@ class SIMTreeClassifier(SIMTree, MoBTreeClassifier, ClassifierMixin):
             best_impurity = self.get_loss(self.y[sample_indice], predict_func(self.x[sample_indice]))
         else:
             base = SimClassifier(reg_gamma=self.reg_gamma, degree=self.degree,
-                          knot_num=self.knot_num, random_state=self.random_state)
+                          knot_num=self.knot_num, dtype=self.dtype, random_state=self.random_state)
             grid = GridSearchCV(base, param_grid={"reg_lambda": self.reg_lambda},
                           scoring={"auc": make_scorer(roc_auc_score, needs_proba=True)},
                           cv=5, refit="auc", n_jobs=1, error_score=np.nan)
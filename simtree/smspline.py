@@ -4,7 +4,7 @@ from matplotlib import gridspec
 from matplotlib import pyplot as plt
 from abc import ABCMeta, abstractmethod
 
-from sklearn.utils.extmath import softmax
+from scipy.special import expit
 from sklearn.preprocessing import LabelBinarizer
 from sklearn.utils.validation import check_is_fitted
 from sklearn.utils import check_X_y
@@ -54,6 +54,19 @@ class BaseSMSpline(BaseEstimator, metaclass=ABCMeta):
 
         self.density_, self.bins_ = np.histogram(x, bins=10, density=True)
 
+    def _is_constant(self, x):
+
+        """method to check whether the input data take a single value (rounded to 6 decimals),
+        rounding is monotone so comparing the rounded extremes avoids sorting the data
+
+        Parameters
+        ---------
+        x : array-like of shape (n_samples, 1)
+            containing the input dataset
+        """
+
+        return np.round(x.min(), decimals=6) == np.round(x.max(), decimals=6)
+
     def diff(self, x, order=1):
 
         """method to calculate derivatives of the fitted adaptive spline to the input
@@ -67,6 +80,7 @@ class BaseSMSpline(BaseEstimator, metaclass=ABCMeta):
         """
         if order > self.degree:
             raise Exception("order should not be greater than degree")
+        x = np.asarray(x, dtype=np.float64)
         if isinstance(self.sm_, (np.ndarray, np.int, int, np.floating, float)):
             derivative = np.zeros((x.shape[0], 1))
         elif "modelspec" in self.sm_.names:
@@ -125,7 +139,7 @@ class BaseSMSpline(BaseEstimator, metaclass=ABCMeta):
         """
 
         check_is_fitted(self, "sm_")
-        x = x.copy()
+        x = np.array(x, dtype=np.float64)
         x[x < self.xmin] = self.xmin
         x[x > self.xmax] = self.xmax
         if isinstance(self.sm_, (np.ndarray, np.int, int, np.floating, float)):
@@ -226,8 +240,7 @@ class SMSplineRegressor(BaseSMSpline, RegressorMixin):
         x, y = self._validate_input(x, y)
         self._estimate_density(x)
 
-        unique_num = len(np.unique(x.round(decimals=6)))
-        if unique_num <= 1:
+        if self._is_constant(x):
             self.sm_ = np.mean(y)
         else:
             kwargs = {"x": x.ravel(),
@@ -353,8 +366,7 @@ class SMSplineClassifier(BaseSMSpline, ClassifierMixin):
         x, y = self._validate_input(x, y)
         self._estimate_density(x)
 
-        unique_num = len(np.unique(x.round(decimals=6)))
-        if unique_num <= 1:
+        if self._is_constant(x):
             p = np.clip(np.mean(y), EPSILON, 1. - EPSILON)
             self.sm_ = np.log(p / (1 - p))
         else:
@@ -392,7 +404,9 @@ class SMSplineClassifier(BaseSMSpline, ClassifierMixin):
         """
 
         pred = self.decision_function(x)
-        pred_proba = softmax(np.vstack([-pred, pred]).T / 2, copy=False)
+        pred_proba = np.empty((pred.shape[0], 2))
+        expit(pred, out=pred_proba[:, 1])
+        expit(- pred, out=pred_proba[:, 0])
         return pred_proba
 
     def predict(self, x):